@@ -2,6 +2,7 @@ import streamlit as st
 from streamlit_gsheets import GSheetsConnection
 import pandas as pd
 from google import genai
+from google.genai import types
 import extra_streamlit_components as stx
 from datetime import datetime, timedelta # ⭐ timedelta 추가
 import hashlib
@@ -10,6 +11,18 @@ import re
 import uuid
 import time
 import random
+import os
+import concurrent.futures
+import base64
+import gzip
+import tempfile
+import logging
+import threading
+from collections import deque
+
+from chat_cache import generate_chat_reply, evict_chat_cache
+from mood_score import local_mood_score
+from sheet_ops import apply_sheet_ops
 
 # --- 1. 기본 설정 및 디자인 ---
 st.set_page_config(
@@ -102,6 +115,11 @@ MOOD_EMOJIS = {
     5: "🌈 무지개 (매우 좋음)"
 }
 
+logger = logging.getLogger("emotion_diary")
+if not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
 # --- 2. 세션 초기화 및 자동 로그인 ---
 # 쿠키 매니저 실행
 cookie_manager = stx.CookieManager()
@@ -116,13 +134,288 @@ if 'auth_mode' not in st.session_state:
 
 conn = st.connection("gsheets", type=GSheetsConnection)
 
+# ⭐ 서버 전체 요청 제한 (세션/탭이 바뀌어도 유지되도록 프로세스 단위로 관리)
+RATE_LIMITS = {  # 작업별 슬라이딩 윈도우 목록: (윈도우 초, 허용 횟수)
+    "login": [(3, 1), (300, 20)],          # 접속(클라이언트) 기준
+    "login_failure": [(300, 10)],          # 아이디 기준, 실패한 시도만 기록
+    "signup": [(5, 1), (3600, 5)],
+    "diary_save": [(5, 1), (600, 20)],
+    "chat": [(2, 1), (60, 15)],
+    "profile": [(3, 1), (600, 10)],
+}
+WRITE_OPERATIONS = {"signup", "diary_save", "chat", "profile"}
+GLOBAL_WRITE_WINDOW_SEC = 60
+GLOBAL_WRITE_LIMIT = 50        # 시트 쓰기 한도(분당 60회)보다 여유 있게
+GLOBAL_SHED_RATIO = 0.9        # 전체 예산의 90%를 넘으면 새 쓰기 작업은 받지 않음
+WRITE_QUEUE_MAX_WAIT_SEC = 5   # 예산이 찼을 때 쓰기가 빈 자리를 기다리는 최대 시간
+
+@st.cache_resource
+def get_admission_state():
+    return {"lock": threading.Lock(), "windows": {}, "rejections": {}}
+
+def client_key():
+    ip_address = getattr(getattr(st, "context", None), "ip_address", None)
+    if ip_address:
+        return ip_address
+    # IP를 알 수 없으면(로컬 실행 등) 모두가 한 버킷을 공유하지 않도록 세션별 키 사용
+    if 'client_key' not in st.session_state:
+        st.session_state['client_key'] = str(uuid.uuid4())
+    return f"session:{st.session_state['client_key']}"
+
+def window_count(timestamps, window, now):
+    while timestamps and now - timestamps[0] >= window:
+        timestamps.popleft()
+    return len(timestamps)
+
+def record_rejection(state, operation, reason):
+    key = f"{operation}:{reason}"
+    state["rejections"][key] = state["rejections"].get(key, 0) + 1
+    logger.warning("admission rejected: op=%s reason=%s total=%d", operation, reason, state["rejections"][key])
+
+def check_rate_limit(operation, user_key, record=True):
+    """
+    작업별 윈도우 한도를 검사하고 통과하면 시도를 기록. record=False면 검사만 (기록은 record_attempt로)
+    """
+    state = get_admission_state()
+    now = time.time()
+    with state["lock"]:
+        windows = state["windows"]
+        if len(windows) > 5000: # 오래된 빈 윈도우 정리
+            for k in [k for k, q in windows.items() if window_count(q, k[2], now) == 0]:
+                del windows[k]
+
+        for window, limit in RATE_LIMITS[operation]:
+            timestamps = windows.setdefault((operation, user_key, window), deque())
+            if window_count(timestamps, window, now) >= limit:
+                wait_sec = window - (now - timestamps[0])
+                record_rejection(state, operation, "user")
+                st.toast(f"🚫 너무 빠릅니다! {int(wait_sec) + 1}초 뒤에 다시 시도해주세요.", icon="⏳")
+                return False
+
+        if operation in WRITE_OPERATIONS:
+            global_writes = windows.setdefault(("sheet_write", "*", GLOBAL_WRITE_WINDOW_SEC), deque())
+            if window_count(global_writes, GLOBAL_WRITE_WINDOW_SEC, now) >= GLOBAL_WRITE_LIMIT * GLOBAL_SHED_RATIO:
+                record_rejection(state, operation, "global")
+                st.toast("🚦 지금 이용자가 많아 잠시 요청을 받을 수 없어요. 잠시 후 다시 시도해주세요.", icon="⏳")
+                return False
+
+        if record:
+            for window, _ in RATE_LIMITS[operation]:
+                windows[(operation, user_key, window)].append(now)
+    return True
+
+def record_attempt(operation, user_key):
+    state = get_admission_state()
+    now = time.time()
+    with state["lock"]:
+        for window, _ in RATE_LIMITS[operation]:
+            state["windows"].setdefault((operation, user_key, window), deque()).append(now)
+
+def acquire_write_slot():
+    """
+    전체 시트 쓰기 예산에서 한 자리를 확보. 가득 찼으면 잠시 기다리고, 그래도 없으면 False
+    """
+    state = get_admission_state()
+    deadline = time.time() + WRITE_QUEUE_MAX_WAIT_SEC
+    while True:
+        now = time.time()
+        with state["lock"]:
+            global_writes = state["windows"].setdefault(("sheet_write", "*", GLOBAL_WRITE_WINDOW_SEC), deque())
+            if window_count(global_writes, GLOBAL_WRITE_WINDOW_SEC, now) < GLOBAL_WRITE_LIMIT:
+                global_writes.append(now)
+                return True
+            wait_sec = GLOBAL_WRITE_WINDOW_SEC - (now - global_writes[0])
+        if now + wait_sec > deadline:
+            with state["lock"]:
+                record_rejection(state, "sheet_write", "budget")
+            return False
+        time.sleep(max(0.05, wait_sec))
+
+# ⭐ 로컬 스냅샷 계층: 시트가 느리거나 장애일 때 화면 표시용 읽기는 스냅샷으로 응답하고,
+#    쓰기는 행 단위 작업(추가/수정/삭제)으로 대기열에 보관했다가 복구 후 최신 시트에 다시 적용
+SNAPSHOT_DIR = ".snapshots"
+SNAPSHOT_REFRESH_SEC = 300  # 백그라운드 스냅샷 갱신 주기 (이 시간 안의 스냅샷은 캐시 읽기에 바로 사용)
+REMOTE_TIMEOUT_SEC = 8      # 표시용 읽기에서 시트 응답이 이보다 늦으면 스냅샷으로 대체
+SNAPSHOT_WORKSHEETS = ("users", "diaries")
+
+@st.cache_resource
+def get_remote_executor():
+    return concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+@st.cache_resource
+def get_pending_lock():
+    return threading.Lock()
+
+def snapshot_path(worksheet, kind="snapshot", ext="parquet"):
+    return os.path.join(SNAPSHOT_DIR, f"{worksheet}.{kind}.{ext}")
+
+def make_temp_path(path):
+    # 여러 스레드가 동시에 저장해도 섞이지 않도록 쓰기마다 고유한 임시 파일 사용
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=SNAPSHOT_DIR, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    os.close(fd)
+    return tmp_path
+
+def save_snapshot(worksheet, df):
+    path = snapshot_path(worksheet)
+    tmp_path = None
+    try:
+        tmp_path = make_temp_path(path)
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path) # 반쯤 쓰인 파일을 읽지 않도록 교체 방식으로 저장
+    except Exception as e:
+        # 스냅샷은 보조 수단이므로 실패해도 본 기능은 그대로 진행
+        logger.warning("snapshot save failed for %s: %s", worksheet, e)
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def load_snapshot(worksheet):
+    path = snapshot_path(worksheet)
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_parquet(path)
+    except Exception:
+        return None
+
+def snapshot_age(worksheet):
+    path = snapshot_path(worksheet)
+    if not os.path.exists(path):
+        return None
+    return time.time() - os.path.getmtime(path)
+
+def load_pending_ops(worksheet):
+    path = snapshot_path(worksheet, "pending", "json")
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return []
+
+def save_pending_ops(worksheet, ops):
+    path = snapshot_path(worksheet, "pending", "json")
+    if not ops:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp_path = make_temp_path(path)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        # numpy 정수 등은 파이썬 기본 타입으로 변환해 저장
+        json.dump(ops, f, ensure_ascii=False, default=lambda o: o.item() if hasattr(o, "item") else str(o))
+    os.replace(tmp_path, path)
+
+def is_worksheet_missing(error):
+    return "WorksheetNotFound" in type(error).__name__ or "not found" in str(error).lower()
+
+def read_sheet(worksheet, ttl=0):
+    """
+    화면 표시용 읽기: 시트가 느리거나 실패하면 마지막 스냅샷으로 응답하고, 대기 중인 쓰기를 덧씌워 보여줌.
+    이 결과로 시트 전체를 덮어쓰면 안 됨 (쓰기 전 읽기는 read_sheet_fresh 사용)
+    """
+    df = None
+    # 캐시 허용 읽기는 신선한 스냅샷으로 바로 응답 (재시작 직후 빠른 시작)
+    if ttl != 0:
+        age = snapshot_age(worksheet)
+        if age is not None and age < SNAPSHOT_REFRESH_SEC:
+            df = load_snapshot(worksheet)
+
+    if df is None:
+        try:
+            future = get_remote_executor().submit(conn.read, worksheet=worksheet, ttl=ttl)
+            df = future.result(timeout=REMOTE_TIMEOUT_SEC)
+            save_snapshot(worksheet, df)
+        except Exception as e:
+            df = load_snapshot(worksheet)
+            if df is None:
+                raise
+            if is_worksheet_missing(e):
+                os.utime(snapshot_path(worksheet)) # 시트가 없다는 결과도 갱신 주기 동안 재사용
+
+    pending = load_pending_ops(worksheet)
+    return apply_sheet_ops(df, pending)[0] if pending else df
+
+def read_sheet_fresh(worksheet):
+    # 쓰기 직전의 읽기: 스냅샷 대체 없이 항상 원격 시트 (실패하면 예외)
+    df = conn.read(worksheet=worksheet, ttl=0)
+    save_snapshot(worksheet, df)
+    return df
+
+def write_sheet(worksheet, data, reserved=False):
+    # 원격에서 방금 읽은 데이터로 만든 전체 시트만 넘길 것. 실패하면 예외
+    # reserved: 호출 측에서 이미 acquire_write_slot으로 자리를 확보한 경우
+    if not reserved and not acquire_write_slot():
+        raise RuntimeError("시트 쓰기 예산 초과")
+    conn.update(worksheet=worksheet, data=data)
+    save_snapshot(worksheet, data)
+
+def update_sheet(worksheet, ops, base=None, notify=True):
+    """
+    행 단위 작업을 최신 원격 시트에 적용해 저장. 실패하면 작업을 대기열에 넣고 False 반환.
+    base: 호출 측에서 방금 read_sheet_fresh로 읽은 데이터 (다시 읽지 않기 위함)
+    """
+    def queue(ops_to_queue, error):
+        save_pending_ops(worksheet, ops_to_queue)
+        logger.warning("queued %d ops for %s: %s", len(ops_to_queue), worksheet, error)
+        if notify and ops:
+            st.toast("⚠️ 저장소 연결이 불안정해 변경 사항을 임시 보관했어요. 연결이 복구되면 자동으로 반영됩니다.", icon="💾")
+        return False
+
+    # 예산이 찼을 때의 대기는 잠금 밖에서 (다른 저장 요청과 백그라운드 반영이 함께 멈추지 않도록)
+    if not acquire_write_slot():
+        with get_pending_lock():
+            return queue(load_pending_ops(worksheet) + ops, "시트 쓰기 예산 초과")
+
+    with get_pending_lock():
+        pending = load_pending_ops(worksheet)
+        # 원격 장애일 때만 대기열에 넣음. 적용 자체가 불가능한 작업은 적용 단계에서 걸러 버림
+        try:
+            if base is None:
+                base = read_sheet_fresh(worksheet)
+        except Exception as e:
+            return queue(pending + ops, e)
+
+        merged, rejected = apply_sheet_ops(base, pending + ops)
+        valid_ops = [op for op in pending + ops if op not in rejected]
+        try:
+            write_sheet(worksheet, merged, reserved=True)
+        except Exception as e:
+            return queue(valid_ops, e)
+        save_pending_ops(worksheet, [])
+    return not any(op in rejected for op in ops)
+
+def flush_pending_writes():
+    for worksheet in SNAPSHOT_WORKSHEETS:
+        if load_pending_ops(worksheet) and not update_sheet(worksheet, [], notify=False):
+            return # 아직 복구되지 않음, 다음 주기에 재시도
+
+def refresh_loop():
+    while True:
+        time.sleep(SNAPSHOT_REFRESH_SEC)
+        try:
+            flush_pending_writes()
+            for worksheet in SNAPSHOT_WORKSHEETS:
+                read_sheet_fresh(worksheet)
+        except Exception as e:
+            logger.warning("snapshot refresh failed: %s", e)
+
+@st.cache_resource
+def start_snapshot_refresher():
+    # 요청 처리와 별개로 주기적으로 대기열을 반영하고 스냅샷을 갱신 (프로세스당 하나)
+    thread = threading.Thread(target=refresh_loop, name="snapshot-refresher", daemon=True)
+    thread.start()
+    return thread
+
+start_snapshot_refresher()
+
 # ⭐ 쿠키에서 자동 로그인 정보 확인 (세션에 로그인 안 되어 있을 때만)
 if not st.session_state['is_logged_in']:
     saved_uuid = cookie_manager.get(cookie="remember_user_id")
     if saved_uuid:
         try:
             # DB에서 해당 UUID를 가진 유저 정보 가져오기
-            users_df = conn.read(worksheet="users", ttl=0)
+            users_df = read_sheet("users", ttl=0)
             user_row = users_df[users_df['user_id'] == saved_uuid]
             
             if not user_row.empty:
@@ -155,15 +448,54 @@ except Exception as e:
 
 # --- 3. 함수 정의 ---
 
-def check_rate_limit(key, limit_sec=3):
-    now = time.time()
-    if key in st.session_state:
-        elapsed = now - st.session_state[key]
-        if elapsed < limit_sec:
-            st.toast(f"🚫 너무 빠릅니다! {int(limit_sec - elapsed) + 1}초 뒤에 다시 시도해주세요.", icon="⏳")
-            return False
-    st.session_state[key] = now
-    return True
+def parse_ai_response(full_res):
+    """
+    JSON 분석 결과를 {'advice', 'score', 'summary', 'tags'} 로 변환. 점수를 읽을 수 없으면 score는 None
+    """
+    fallback = "AI 답변을 받지 못했어요. 나중에 [수정] 버튼을 눌러 다시 분석해주세요!"
+    # 안전 필터 등으로 응답 본문이 비어 있으면 안내 문구로 대체
+    analysis = {"advice": str(full_res).strip() if full_res is not None else fallback, "score": None, "summary": "", "tags": []}
+    try:
+        data = json.loads(full_res)
+    except (TypeError, ValueError):
+        return analysis # 오류 안내 문구 등 JSON이 아닌 응답은 그대로 조언으로 표시
+    if not isinstance(data, dict):
+        return analysis
+
+    # JSON의 null은 빈 값으로 취급 ("None" 문자열이 저장되지 않도록)
+    analysis["advice"] = str(data.get("advice") or "").strip() or fallback
+    try:
+        analysis["score"] = max(1, min(5, int(data.get("score"))))
+    except (TypeError, ValueError):
+        pass
+    analysis["summary"] = str(data.get("summary") or "").strip()
+    tags = data.get("tags") or []
+    if isinstance(tags, list):
+        analysis["tags"] = [str(t).strip().lstrip("#") for t in tags if t is not None and str(t).strip()][:5]
+    return analysis
+
+def format_tags(tags):
+    return ", ".join(tags)
+
+def split_tags(raw_tags):
+    if pd.isna(raw_tags) or not str(raw_tags).strip():
+        return []
+    return [t.strip() for t in str(raw_tags).split(",") if t.strip()]
+
+@st.cache_resource
+def get_score_agreement_stats():
+    return {"total": 0, "exact": 0, "within_one": 0}
+
+def record_score_agreement(local_score, ai_score):
+    stats = get_score_agreement_stats()
+    stats["total"] += 1
+    stats["exact"] += int(local_score == ai_score)
+    stats["within_one"] += int(abs(local_score - ai_score) <= 1)
+    logger.info(
+        "mood score agreement: local=%s ai=%s exact=%.1f%% within_one=%.1f%% (n=%d)",
+        local_score, ai_score,
+        100 * stats["exact"] / stats["total"], 100 * stats["within_one"] / stats["total"], stats["total"]
+    )
 
 def make_hashes(password):
     return hashlib.sha256(str(password).encode()).hexdigest()
@@ -175,7 +507,7 @@ def sanitize_for_sheets(text):
 
 def login_check(username, password):
     try:
-        users_df = conn.read(worksheet="users", ttl=0)
+        users_df = read_sheet("users", ttl=0)
         users_df['password'] = users_df['password'].astype(str)
         input_hash = make_hashes(password)
         
@@ -191,7 +523,7 @@ def login_check(username, password):
 
 def register_user(username, password, name):
     try:
-        users_df = conn.read(worksheet="users", ttl=0)
+        users_df = read_sheet_fresh("users") # 아이디 중복 확인은 원격 최신 데이터로만
         if username in users_df['username'].values:
             return False, "이미 존재하는 아이디입니다."
         
@@ -203,36 +535,32 @@ def register_user(username, password, name):
                 break
 
         pw_hash = make_hashes(password)
-        new_user = pd.DataFrame([{
+        new_user = {
             "user_id": new_uuid,
             "username": username,
             "password": pw_hash,
             "name": name,
             "role": "user"
-        }])
+        }
         
-        updated_df = pd.concat([users_df, new_user], ignore_index=True)
-        conn.update(worksheet="users", data=updated_df)
+        update_sheet("users", [{"op": "append", "row": new_user}], base=users_df)
         return True, "가입 성공"
     except Exception as e:
         return False, f"오류: {e}"
 
 def update_user_info(target_uuid, new_name=None, new_password=None):
     try:
-        users_df = conn.read(worksheet="users", ttl=0)
-        idx_list = users_df.index[users_df['user_id'] == target_uuid].tolist()
-        
-        if not idx_list:
+        users_df = read_sheet("users", ttl=0)
+        if users_df[users_df['user_id'] == target_uuid].empty:
             return False, "사용자 정보를 찾을 수 없습니다."
         
-        idx = idx_list[0]
-        
+        values = {}
         if new_name:
-            users_df.at[idx, 'name'] = new_name
+            values['name'] = new_name
         if new_password:
-            users_df.at[idx, 'password'] = make_hashes(new_password)
+            values['password'] = make_hashes(new_password)
             
-        conn.update(worksheet="users", data=users_df)
+        update_sheet("users", [{"op": "set", "column": "user_id", "value": target_uuid, "values": values}])
         return True, "정보가 성공적으로 수정되었습니다!"
     except Exception as e:
         return False, f"수정 중 오류 발생: {e}"
@@ -244,7 +572,7 @@ def get_past_diaries_text(user_id, days=30):
     """
     try:
         # 데이터 로드 (캐시 활용)
-        df = conn.read(worksheet="diaries", ttl="10m")
+        df = read_sheet("diaries", ttl="10m")
         if df.empty: return "과거 기록 없음"
         
         # 날짜 형식 변환 및 필터링
@@ -264,19 +592,37 @@ def get_past_diaries_text(user_id, days=30):
         if my_history.empty:
             return "최근 작성된 과거 기록이 없습니다."
         
-        # 문자열로 변환 (예: [2026-01-01] (3점) : 오늘은 힘들었다...)
+        # 문자열로 변환 (예: [2026-01-01] (3점) #직장 : 오늘은 힘들었다...)
+        # ⭐ 분석 때 저장해 둔 요약/주제가 있으면 원문 대신 재사용
         history_text = ""
         for _, row in my_history.iterrows():
             date_str = row['date'].strftime("%Y-%m-%d")
             score = row['emotion_tag']
-            content = str(row['content'])[:200] # 너무 길면 200자 정도로 요약
-            history_text += f"[{date_str}] (기분 {score}점): {content}\n"
+            summary = row.get('summary', "")
+            if pd.isna(summary) or not str(summary).strip():
+                content = str(row['content'])[:200] # 너무 길면 200자 정도로 요약
+            else:
+                content = str(summary)
+            tags = " ".join(f"#{t}" for t in split_tags(row.get('tags', "")))
+            history_text += f"[{date_str}] (기분 {score}점) {tags}: {content}\n"
             
         return history_text
         
     except Exception as e:
         return f"기록 불러오기 실패: {e}"
 
+# ⭐ 분석 결과 스키마 (조언 + 점수 + 요약 + 주제를 한 번의 호출로)
+ANALYSIS_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={
+        "advice": types.Schema(type=types.Type.STRING),
+        "score": types.Schema(type=types.Type.INTEGER, minimum=1, maximum=5),
+        "summary": types.Schema(type=types.Type.STRING),
+        "tags": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING)),
+    },
+    required=["advice", "score", "summary", "tags"],
+)
+
 # ⭐ [수정] 프롬프트에 과거 기록(past_history) 반영
 def get_ai_response(user_text, user_name, past_history=""):
     # model = genai.GenerativeModel('gemini-2.5-flash')
@@ -300,12 +646,12 @@ def get_ai_response(user_text, user_name, past_history=""):
     1. **맥락 연결:** 과거 기록과 오늘의 일기를 연결 지어 언급하세요. (예: "지난주에는 ~때문에 힘들어하셨는데, 오늘은 좀 나아지신 것 같아 다행이에요" 또는 "저번부터 계속 ~로 고민이 깊으시군요.")
     2. **호칭:** 반드시 '{user_name}님'이라고 부르세요.
     3. **분량:** 따뜻하고 구체적이며 건설적인 조언으로 3~4문장.
-    4. **평가:** 작성자의 오늘 기분을 1~5점 사이의 정수로 평가 (숫자만 출력).
+    4. **평가:** 작성자의 오늘 기분을 1~5점 사이의 정수로 평가.
+    5. **요약:** 오늘 일기를 나중에 다시 참고할 수 있도록 한 문장(50자 이내)으로 요약.
+    6. **주제:** 일기의 핵심 주제를 짧은 명사 태그 1~5개로 추출 (예: 직장, 가족, 수면).
     
     [출력형식]
-    조언 내용
-    |||
-    점수
+    advice(조언), score(점수), summary(요약), tags(주제 목록) 필드를 가진 JSON
     </instructions>
     """
     max_retries = 3 # 최대 3번 재시도
@@ -314,7 +660,11 @@ def get_ai_response(user_text, user_name, past_history=""):
         try:
             response = client.models.generate_content(
                 model='gemini-2.5-flash',
-                contents=prompt
+                contents=prompt,
+                config=types.GenerateContentConfig(
+                    response_mime_type="application/json",
+                    response_schema=ANALYSIS_SCHEMA
+                )
             )
             return response.text
             
@@ -325,45 +675,14 @@ def get_ai_response(user_text, user_name, past_history=""):
                     time.sleep(20) # 20초 대기 후 다시 시도
                     continue
                 else:
-                    return "서버가 너무 바쁩니다. 나중에 [수정] 버튼을 눌러 다시 분석해주세요! ||| 3"
+                    return "서버가 너무 바쁩니다. 나중에 [수정] 버튼을 눌러 다시 분석해주세요!"
             else:
-                return f"알 수 없는 오류 발생: {e[:50]} ||| 3"
+                return f"알 수 없는 오류 발생: {error_msg[:50]}"
     
-def get_chat_response(diary_content, chat_history, new_question, user_name):
+def get_chat_response(diary_content, chat_history, new_question, user_name, diary_id=None):
     try:
-        # model = genai.GenerativeModel('gemini-2.5-flash')
-        history_text = ""
-        for chat in chat_history:
-            role = "상담사" if chat["role"] == "model" else "내담자"
-            history_text += f"{role}: {chat['text']}\n"
-            
-        prompt = f"""
-        당신은 전문 심리 상담가입니다. 
-        <instructions>
-        내담자의 이름은 '{user_name}'입니다. 대화할 때 '내담자'나 '회원님'이라는 호칭 대신, 반드시 '{user_name}님'이라고 다정하게 불러주세요.
-        사용자의 일기(<diary>)와 이전 대화(<history>)를 바탕으로, 새로운 질문(<question>)에 답변하세요.
-        따뜻하게 공감하는 태도를 유지하세요.
-        </instructions>
-        
-        <diary>
-        {diary_content}
-        </diary>
-        
-        <history>
-        {history_text}
-        </history>
-        
-        <question>
-        {new_question}
-        </question>
-        """
-        # response = model.generate_content(prompt)
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt
-        )
-        return response.text
-        return response.text
+        # ⭐ 일기별 프롬프트 캐시를 사용 (chat_cache.py)
+        return generate_chat_reply(client, diary_content, chat_history, new_question, user_name, diary_id=diary_id)
     except Exception as e:
         error_msg = str(e)
         # ⭐ 채팅 중 한도 초과 시 안내
@@ -383,17 +702,189 @@ def confirm_reset_dialog(row_id):
             st.rerun()
     with col_yes:
         if st.button("확인 (삭제)", type="primary", use_container_width=True):
+            if not check_rate_limit("chat", st.session_state['user_info']['user_id']):
+                return
             try:
-                all_diaries = conn.read(worksheet="diaries", ttl=0)
-                all_diaries['id'] = pd.to_numeric(all_diaries['id'], errors='coerce')
-                target_idx = all_diaries.index[all_diaries['id'] == pd.to_numeric(row_id, errors='coerce')].tolist()[0]
-                all_diaries.at[target_idx, 'chat_history'] = "[]"
-                conn.update(worksheet="diaries", data=all_diaries)
+                diary_id = int(pd.to_numeric(row_id, errors='coerce'))
+                update_sheet("diaries", [{"op": "set", "column": "id", "value": diary_id, "values": {"chat_history": "[]"}}])
+                evict_chat_cache(diary_id, client)
                 st.cache_data.clear()
+                st.session_state.pop('export_csv', None) # 내보내기 파일은 다시 만들어야 함
                 st.rerun()
             except Exception as e:
                 st.error(f"오류가 발생했습니다: {e}")
 
+# ⭐ 보관(아카이브) 계층: 오래된 일기는 유저/연도별로 압축해 연도별 'archive_YYYY' 시트로 옮겨 hot 시트를 작게 유지
+#    어떤 달이 보관돼 있는지와 최대 id는 작은 'archive_index' 시트에만 기록 (목록 표시에 본문을 내려받지 않도록)
+ARCHIVE_INDEX_WORKSHEET = "archive_index"
+ARCHIVE_INDEX_COLUMNS = ['user_id', 'year', 'months', 'max_id', 'parts']
+ARCHIVE_COLUMNS = ['user_id', 'part', 'payload']
+ARCHIVE_PART_CHARS = 40000     # 시트 셀 하나의 글자 수 한도(5만)보다 작게 분할
+
+def get_archive_after_days():
+    try:
+        return int(st.secrets.get("ARCHIVE_AFTER_DAYS", 365))
+    except Exception:
+        return 365
+
+def read_or_create_worksheet(worksheet, columns):
+    """
+    쓰기 전 원격 읽기. 워크시트가 아직 없으면 빈 시트를 만들어 반환 (연결 오류 등은 그대로 예외)
+    """
+    try:
+        return read_sheet_fresh(worksheet)
+    except Exception as e:
+        if not is_worksheet_missing(e):
+            raise
+    empty_df = pd.DataFrame(columns=columns)
+    conn.create(worksheet=worksheet, data=empty_df)
+    logger.info("created worksheet %s", worksheet)
+    return empty_df
+
+def encode_partition(df):
+    records = df.astype(object).where(df.notna(), None).to_dict("records")
+    raw = json.dumps(records, ensure_ascii=False, default=str).encode("utf-8")
+    return base64.b64encode(gzip.compress(raw)).decode("ascii")
+
+def decode_partition(payload):
+    raw = gzip.decompress(base64.b64decode(payload))
+    return pd.DataFrame(json.loads(raw.decode("utf-8")))
+
+def archive_worksheet(year):
+    return f"archive_{int(year)}"
+
+def read_archive_index():
+    try:
+        index_df = read_sheet(ARCHIVE_INDEX_WORKSHEET, ttl="10m")
+    except Exception as e:
+        empty_df = pd.DataFrame(columns=ARCHIVE_INDEX_COLUMNS)
+        if is_worksheet_missing(e):
+            # 아직 보관 작업이 한 번도 실행되지 않음: 빈 인덱스를 스냅샷으로 남겨 매 요청마다 시트를 찌르지 않도록
+            save_snapshot(ARCHIVE_INDEX_WORKSHEET, empty_df)
+        return empty_df
+    if index_df.empty or 'user_id' not in index_df.columns:
+        return pd.DataFrame(columns=ARCHIVE_INDEX_COLUMNS)
+    return index_df.dropna(subset=['user_id'])
+
+def archive_index(user_id):
+    """
+    보관된 달 목록을 {'YYYY-MM': 연도} 로 반환 (인덱스 시트만 사용)
+    """
+    index_df = read_archive_index()
+    index = {}
+    for _, row in index_df[index_df['user_id'] == user_id].iterrows():
+        for month in str(row['months']).split(","):
+            if month.strip():
+                index[month.strip()] = int(row['year'])
+    return index
+
+def load_archive_partition(user_id, year, year_df=None):
+    # 해당 연도의 보관 시트만 읽어 이 유저의 조각을 이어 붙인 뒤 압축 해제
+    if year_df is None:
+        try:
+            year_df = read_sheet(archive_worksheet(year), ttl="10m")
+        except Exception:
+            return pd.DataFrame()
+    if year_df.empty or 'user_id' not in year_df.columns:
+        return pd.DataFrame()
+    parts = year_df[year_df['user_id'] == user_id]
+    if parts.empty:
+        return pd.DataFrame()
+    parts = parts.assign(part=pd.to_numeric(parts['part'], errors='coerce')).sort_values('part')
+    return decode_partition("".join(parts['payload'].astype(str)))
+
+def next_diary_id(diaries_df):
+    # 보관된 일기의 id와 겹치지 않도록 인덱스의 최대 id도 함께 고려
+    ids = pd.Series(dtype=float)
+    if not diaries_df.empty and 'id' in diaries_df.columns:
+        ids = pd.to_numeric(diaries_df['id'], errors='coerce')
+    index_df = read_archive_index()
+    if not index_df.empty:
+        ids = pd.concat([ids, pd.to_numeric(index_df['max_id'], errors='coerce')])
+    max_id = ids.max()
+    return 1 if pd.isna(max_id) else int(max_id) + 1
+
+def run_archive_job():
+    """
+    보관 기준일보다 오래된 일기를 유저/연도별 압축 파티션으로 옮기고, 옮긴 개수를 반환
+    """
+    diaries_df = read_sheet_fresh("diaries")
+    if diaries_df.empty or 'date' not in diaries_df.columns or 'user_id' not in diaries_df.columns:
+        return 0
+
+    dates = pd.to_datetime(diaries_df['date'], errors='coerce')
+    cutoff_date = datetime.now() - timedelta(days=get_archive_after_days())
+    old_mask = dates < cutoff_date
+    if not old_mask.any():
+        return 0
+
+    old_rows = diaries_df[old_mask]
+    old_years = dates[old_mask].dt.year
+    index_rows = []
+    for year, year_rows in old_rows.groupby(old_years):
+        year = int(year)
+        year_df = read_or_create_worksheet(archive_worksheet(year), ARCHIVE_COLUMNS)
+        if year_df.empty or 'user_id' not in year_df.columns:
+            year_df = pd.DataFrame(columns=ARCHIVE_COLUMNS)
+
+        new_parts = []
+        for user_id, group in year_rows.groupby('user_id'):
+            existing = load_archive_partition(user_id, year, year_df)
+            merged = pd.concat([existing, group], ignore_index=True) if not existing.empty else group.copy()
+            merged['id'] = pd.to_numeric(merged['id'], errors='coerce')
+            merged = merged.drop_duplicates(subset='id', keep='last')
+
+            payload = encode_partition(merged)
+            chunks = [payload[i:i + ARCHIVE_PART_CHARS] for i in range(0, len(payload), ARCHIVE_PART_CHARS)]
+            new_parts += [{"user_id": user_id, "part": part, "payload": chunk} for part, chunk in enumerate(chunks)]
+            months = sorted(pd.to_datetime(merged['date'], errors='coerce').dt.strftime('%Y-%m').dropna().unique())
+            index_rows.append({
+                "user_id": user_id,
+                "year": year,
+                "months": ",".join(months),
+                "max_id": int(merged['id'].max()),
+                "parts": len(chunks)
+            })
+
+        touched_users = set(year_rows['user_id'])
+        kept = year_df[~year_df['user_id'].isin(touched_users)]
+        write_sheet(archive_worksheet(year), pd.concat([kept, pd.DataFrame(new_parts)], ignore_index=True))
+
+    # 본문을 모두 저장한 뒤 인덱스를 갱신하고, 마지막에 hot 시트에서 삭제 (중간에 실패해도 유실 대신 중복만 남음)
+    index_df = read_or_create_worksheet(ARCHIVE_INDEX_WORKSHEET, ARCHIVE_INDEX_COLUMNS)
+    if index_df.empty or 'user_id' not in index_df.columns:
+        index_df = pd.DataFrame(columns=ARCHIVE_INDEX_COLUMNS)
+    touched = {(row["user_id"], row["year"]) for row in index_rows}
+    index_keys = zip(index_df['user_id'], pd.to_numeric(index_df['year'], errors='coerce'))
+    keep_mask = [key not in touched for key in index_keys]
+    write_sheet(ARCHIVE_INDEX_WORKSHEET, pd.concat([index_df[keep_mask], pd.DataFrame(index_rows)], ignore_index=True))
+
+    archived_ids = [int(i) for i in pd.to_numeric(diaries_df.loc[old_mask, 'id'], errors='coerce').dropna()]
+    update_sheet("diaries", [{"op": "delete", "column": "id", "value": archived_ids}], notify=False)
+    st.cache_data.clear()
+    logger.info("archived %d diaries into %d partitions", int(old_mask.sum()), len(index_rows))
+    return int(old_mask.sum())
+
+def export_user_diaries(user_id):
+    """
+    hot 시트와 모든 보관 파티션을 합쳐 해당 유저의 전체 일기를 CSV(bytes)로 반환
+    """
+    diaries_df = read_sheet("diaries", ttl="10m")
+    frames = []
+    if not diaries_df.empty and 'user_id' in diaries_df.columns:
+        frames.append(diaries_df[diaries_df['user_id'] == user_id])
+    for year in sorted(set(archive_index(user_id).values())):
+        frames.append(load_archive_partition(user_id, year))
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return b""
+
+    export_df = pd.concat(frames, ignore_index=True)
+    export_df['id'] = pd.to_numeric(export_df['id'], errors='coerce')
+    export_df = export_df.drop_duplicates(subset='id', keep='first').sort_values('date')
+    export_cols = [c for c in ['date', 'content', 'emotion_tag', 'ai_advice', 'summary', 'tags', 'chat_history'] if c in export_df.columns]
+    return export_df[export_cols].to_csv(index=False).encode("utf-8-sig") # 엑셀에서 한글이 깨지지 않도록 BOM 포함
+
 # --- 4. 화면 로직 ---
 
 if not st.session_state['is_logged_in']:
@@ -410,7 +901,8 @@ if not st.session_state['is_logged_in']:
                 input_pw = st.text_input("비밀번호", type="password")
                 submitted = st.form_submit_button("로그인", type="primary", use_container_width=True)
                 if submitted:
-                    if check_rate_limit("login_attempt", 3):
+                    # 접속 기준으로 먼저 제한하고, 아이디별로는 실패 횟수만 제한 (남의 아이디로 일부러 잠그기 어렵게)
+                    if check_rate_limit("login", client_key()) and check_rate_limit("login_failure", input_id, record=False):
                         safe_id = sanitize_for_sheets(input_id)
                         user = login_check(safe_id, input_pw)
                         if user is not None:
@@ -423,6 +915,7 @@ if not st.session_state['is_logged_in']:
                             
                             st.rerun()
                         else:
+                            record_attempt("login_failure", input_id)
                             st.error("아이디 또는 비밀번호를 확인해주세요.")
             
             st.write("")
@@ -453,7 +946,7 @@ if not st.session_state['is_logged_in']:
                 signup_submitted = st.form_submit_button("가입하기", type="primary", use_container_width=True)
                 
                 if signup_submitted:
-                    if check_rate_limit("signup_attempt", 5):
+                    if check_rate_limit("signup", client_key()):
                         if captcha_ans.strip() != str(c_num1 + c_num2):
                             st.error("산수 문제 정답이 틀렸습니다.")
                             st.session_state['captcha_num1'] = random.randint(1, 10)
@@ -509,6 +1002,7 @@ else:
         st.markdown("---")
         if st.button("로그아웃", type="secondary", use_container_width=True):
             st.session_state['is_logged_in'] = False
+            st.session_state.pop('export_csv', None) # 다음 로그인 사용자에게 이전 사용자의 내보내기 파일이 보이지 않도록
             cookie_manager.delete("remember_user_id") # ⭐ 쿠키 삭제
             st.query_params.clear()
             st.rerun()
@@ -518,8 +1012,8 @@ else:
         st.header("👑 관리자 대시보드")
         
         try:
-            all_users = conn.read(worksheet="users", ttl="10m")
-            all_diaries = conn.read(worksheet="diaries", ttl="10m")
+            all_users = read_sheet("users", ttl="10m")
+            all_diaries = read_sheet("diaries", ttl="10m")
             
             c1, c2, c3 = st.columns(3)
             with c1: st.metric("총 가입자 수", f"{len(all_users)}명")
@@ -528,8 +1022,16 @@ else:
                 avg_mood = all_diaries['emotion_tag'].mean() if not all_diaries.empty else 0
                 st.metric("전체 평균 기분", f"{avg_mood:.1f}점")
             
+            agreement = get_score_agreement_stats()
+            if agreement["total"]:
+                st.caption(f"🧮 임시 점수와 AI 점수 일치율: {100 * agreement['exact'] / agreement['total']:.0f}% (±1점 이내 {100 * agreement['within_one'] / agreement['total']:.0f}%, {agreement['total']}건)")
+            
+            rejections = get_admission_state()["rejections"]
+            if rejections:
+                st.caption("🚦 요청 제한 거절: " + ", ".join(f"{k} {v}회" for k, v in sorted(rejections.items())))
+            
             st.divider()
-            admin_tab1, admin_tab2 = st.tabs(["👥 유저 관리", "📝 전체 일기 모니터링"])
+            admin_tab1, admin_tab2, admin_tab3 = st.tabs(["👥 유저 관리", "📝 전체 일기 모니터링", "🗄️ 보관 관리"])
             
             with admin_tab1:
                 st.subheader("가입자 목록")
@@ -540,12 +1042,25 @@ else:
                 if not all_diaries.empty:
                     merged_df = pd.merge(all_diaries, all_users[['user_id', 'name']], on='user_id', how='left')
                     merged_df['date'] = pd.to_datetime(merged_df['date'])
+                    admin_cols = ['date', 'name', 'content', 'emotion_tag', 'ai_advice'] + [c for c in ['summary', 'tags'] if c in merged_df.columns]
                     st.dataframe(
-                        merged_df[['date', 'name', 'content', 'emotion_tag', 'ai_advice']].sort_values('date', ascending=False),
+                        merged_df[admin_cols].sort_values('date', ascending=False),
                         use_container_width=True, height=400
                     )
                 else:
                     st.info("작성된 일기가 없습니다.")
+            
+            with admin_tab3:
+                st.subheader("오래된 일기 보관")
+                st.write(f"작성일이 **{get_archive_after_days()}일** 지난 일기는 유저/연도별로 압축되어 연도별 `archive_YYYY` 시트로 옮겨집니다. 보관 시트가 없으면 처음 실행할 때 만들어집니다.")
+                st.metric("보관 파티션 수", f"{len(read_archive_index())}개")
+                if st.button("지금 보관 실행", type="primary"):
+                    try:
+                        with st.spinner("보관 중..."):
+                            moved = run_archive_job()
+                        st.toast(f"🗄️ {moved}개의 일기를 보관했습니다.", icon="✅")
+                    except Exception as e:
+                        st.error(f"보관 작업 실패: {e}")
         except Exception as e:
             st.error(f"관리자 데이터 로드 실패: {e}")
 
@@ -554,7 +1069,7 @@ else:
         st.header("📈 내 마음의 날씨 흐름")
         
         try:
-            all_diaries = conn.read(worksheet="diaries", ttl="10m")
+            all_diaries = read_sheet("diaries", ttl="10m")
             if not all_diaries.empty:
                 all_diaries['chat_history'] = all_diaries.get('chat_history', pd.Series()).fillna("[]").astype(str)
 
@@ -566,21 +1081,51 @@ else:
             else: my_data = pd.DataFrame()
         except Exception:
             my_data = pd.DataFrame()
+        archived_months = archive_index(current_user_id)
 
-        if not my_data.empty:
-            my_data['month_str'] = my_data['date'].dt.strftime('%Y-%m')
-            available_months = sorted(my_data['month_str'].unique(), reverse=True)
-            col_sel, _ = st.columns([1, 3])
+        if not my_data.empty or archived_months:
+            hot_months = set()
+            if not my_data.empty:
+                my_data['month_str'] = my_data['date'].dt.strftime('%Y-%m')
+                hot_months = set(my_data['month_str'])
+            available_months = sorted(hot_months | set(archived_months), reverse=True)
+            col_sel, col_search = st.columns([1, 3])
             with col_sel:
                 selected_month = st.selectbox("📅 월 선택", available_months)
+            with col_search:
+                search_query = st.text_input("🔎 기록 검색 (요약·주제·내용)", placeholder="예: 직장, 가족")
             
-            filtered_data = my_data[my_data['month_str'] == selected_month].sort_values('date')
+            # ⭐ 보관된 달을 고른 경우에만 해당 연도 파티션을 불러와 합침
+            if selected_month in archived_months:
+                archived = load_archive_partition(current_user_id, archived_months[selected_month])
+                if not archived.empty:
+                    archived['date'] = pd.to_datetime(archived['date'])
+                    archived['emotion_tag'] = pd.to_numeric(archived['emotion_tag'], errors='coerce')
+                    archived['month_str'] = archived['date'].dt.strftime('%Y-%m')
+                    my_data = pd.concat([archived, my_data], ignore_index=True)
+                    my_data['id'] = pd.to_numeric(my_data['id'], errors='coerce')
+                    my_data = my_data.drop_duplicates(subset='id', keep='last')
+            
+            if 'month_str' in my_data.columns:
+                filtered_data = my_data[my_data['month_str'] == selected_month].sort_values('date')
+            else: filtered_data = pd.DataFrame() # hot 기록이 없고 보관 파티션도 비어 있는 경우
+            if 'tags' not in filtered_data.columns: filtered_data['tags'] = ""
+            if 'summary' not in filtered_data.columns: filtered_data['summary'] = ""
+            if search_query and not filtered_data.empty:
+                # ⭐ 분석 때 저장한 요약/주제를 검색에 재사용 (추가 AI 호출 없음)
+                search_text = filtered_data['tags'].fillna("").astype(str) + " " + filtered_data['summary'].fillna("").astype(str) + " " + filtered_data['content'].fillna("").astype(str)
+                filtered_data = filtered_data[search_text.str.contains(search_query, case=False, regex=False)]
             
             if not filtered_data.empty:
                 st.markdown("##### 감정 변화 그래프")
                 chart_data = filtered_data.set_index('date')['emotion_tag']
                 st.line_chart(chart_data, color="#87CEEB")
                 
+                tag_counts = pd.Series([t for raw in filtered_data['tags'] for t in split_tags(raw)]).value_counts()
+                if not tag_counts.empty:
+                    st.markdown("##### 이번 달 자주 등장한 주제")
+                    st.write("  ".join(f"`#{tag}` {cnt}회" for tag, cnt in tag_counts.head(5).items()))
+                
                 st.markdown("---")
                 st.subheader(f"📋 {selected_month}의 기록들")
                 display_df = filtered_data.sort_values(by="date", ascending=False)
@@ -589,16 +1134,30 @@ else:
                     except: score = 3
                     with st.expander(f"{row['date'].strftime('%Y-%m-%d')} : {MOOD_EMOJIS.get(score, '')}"):
                         st.write(row['content'])
+                        row_tags = split_tags(row['tags'])
+                        if row_tags: st.caption(" ".join(f"#{t}" for t in row_tags))
                         st.markdown(f"<div style='background-color:#F5F5F5; padding:10px; border-radius:10px; margin-top:10px;'>💌 <b>AI:</b> {row['ai_advice']}</div>", unsafe_allow_html=True)
             else: st.info("선택하신 달의 데이터가 없습니다.")
         else: st.info("아직 기록된 일기가 없습니다.")
 
+        if not my_data.empty or archived_months:
+            st.markdown("---")
+            if st.button("📦 전체 기록 내보내기 준비", type="secondary"):
+                with st.spinner("보관된 기록까지 모으는 중..."):
+                    st.session_state['export_csv'] = {"user_id": current_user_id, "data": export_user_diaries(current_user_id)}
+            export = st.session_state.get('export_csv')
+            if export and export["user_id"] == current_user_id and export["data"]:
+                st.download_button(
+                    "⬇️ CSV 다운로드", data=export["data"],
+                    file_name=f"diary_{datetime.now().strftime('%Y%m%d')}.csv", mime="text/csv"
+                )
+
     # === [메뉴 2] 일기 쓰기 ===
     elif menu == "🖊️ 일기 쓰기":
         st.header("오늘의 마음 기록하기 🖊️")
         
         try:
-            all_diaries = conn.read(worksheet="diaries", ttl="10m")
+            all_diaries = read_sheet("diaries", ttl="10m")
             if not all_diaries.empty:
                 all_diaries['chat_history'] = all_diaries.get('chat_history', pd.Series()).fillna("[]").astype(str)
                 
@@ -628,24 +1187,30 @@ else:
                 with st.form("edit_form"):
                     content = st.text_area("내용", value=row['content'], height=150)
                     if st.form_submit_button("수정 및 재분석 🔄", type="primary"):
-                        if check_rate_limit("edit_diary", 5):
+                        if check_rate_limit("diary_save", current_user_id):
                             with st.spinner("분석 중..."):
                                 safe_content = sanitize_for_sheets(content)
                                 # 수정 모드에서는 기존 데이터만으로 분석 (과거 기록 연결은 선택사항이나 여기선 단순 유지)
+                                local_score = local_mood_score(safe_content)
                                 full_res = get_ai_response(safe_content, current_name) 
-                                if "|||" in full_res: advice, sc = full_res.split("|||"); score=int(sc.strip())
-                                else: advice=full_res; score=3
+                                analysis = parse_ai_response(full_res)
+                                ai_score = analysis["score"]
+                                if ai_score is not None: record_score_agreement(local_score, ai_score)
+                                score = ai_score if ai_score is not None else local_score
                                 
-                                all_diaries_latest = conn.read(worksheet="diaries", ttl=0)
-                                all_diaries_latest['id'] = pd.to_numeric(all_diaries_latest['id'], errors='coerce')
-                                idx = all_diaries_latest.index[all_diaries_latest['id'] == pd.to_numeric(row['id'], errors='coerce')].tolist()[0]
-                                all_diaries_latest.at[idx, 'content'] = safe_content
-                                all_diaries_latest.at[idx, 'ai_advice'] = advice.strip()
-                                all_diaries_latest.at[idx, 'emotion_tag'] = max(1, min(5, score))
-                                all_diaries_latest.at[idx, 'chat_history'] = "[]"
+                                diary_id = int(pd.to_numeric(row['id'], errors='coerce'))
+                                update_sheet("diaries", [{"op": "set", "column": "id", "value": diary_id, "values": {
+                                    "content": safe_content,
+                                    "ai_advice": analysis["advice"],
+                                    "emotion_tag": score,
+                                    "summary": sanitize_for_sheets(analysis["summary"]),
+                                    "tags": sanitize_for_sheets(format_tags(analysis["tags"])),
+                                    "chat_history": "[]"
+                                }}])
+                                evict_chat_cache(diary_id, client) # 내용이 바뀌었으니 캐시 폐기
                                 
-                                conn.update(worksheet="diaries", data=all_diaries_latest)
                                 st.cache_data.clear()
+                                st.session_state.pop('export_csv', None)
                                 st.rerun()
 
             st.markdown(f"""<div class="advice-box">{row['ai_advice']}</div>""", unsafe_allow_html=True)
@@ -678,71 +1243,79 @@ else:
                         st.markdown(f"""<div class="chat-row model"><div class="chat-icon">🤖</div><div class="chat-bubble model-bubble">{chat['text']}</div></div>""", unsafe_allow_html=True)
 
             if user_input := st.chat_input("하고 싶은 말을 적어보세요..."):
-                if check_rate_limit("chat_attempt", 2):
+                if check_rate_limit("chat", current_user_id):
                     st.markdown(f"""<div class="chat-row user"><div class="chat-bubble user-bubble">{user_input}</div><div class="chat-icon">👤</div></div>""", unsafe_allow_html=True)
                     chat_history.append({"role": "user", "text": user_input})
 
                     with st.spinner("답변 작성 중..."):
-                        ai_reply = get_chat_response(row['content'], chat_history, user_input, current_name)
+                        # 방금 추가한 질문은 <question>으로 따로 전달하므로 이전 대화에서는 제외
+                        ai_reply = get_chat_response(
+                            row['content'], chat_history[:-1], user_input, current_name,
+                            diary_id=int(pd.to_numeric(row['id'], errors='coerce'))
+                        )
                     
                     st.markdown(f"""<div class="chat-row model"><div class="chat-icon">🤖</div><div class="chat-bubble model-bubble">{ai_reply}</div></div>""", unsafe_allow_html=True)
                     chat_history.append({"role": "model", "text": ai_reply})
 
                     updated_history_json = json.dumps(chat_history, ensure_ascii=False)
                     
-                    all_diaries_latest = conn.read(worksheet="diaries", ttl=0)
-                    all_diaries_latest['id'] = pd.to_numeric(all_diaries_latest['id'], errors='coerce')
-                    target_idx = all_diaries_latest.index[all_diaries_latest['id'] == pd.to_numeric(row['id'], errors='coerce')].tolist()[0]
-                    all_diaries_latest.at[target_idx, 'chat_history'] = updated_history_json
-                    conn.update(worksheet="diaries", data=all_diaries_latest)
+                    diary_id = int(pd.to_numeric(row['id'], errors='coerce'))
+                    update_sheet("diaries", [{"op": "set", "column": "id", "value": diary_id, "values": {"chat_history": updated_history_json}}])
                     st.cache_data.clear()
+                    st.session_state.pop('export_csv', None)
 
         # --- [신규 작성 모드] ---
         else:
             with st.form("new_diary_form"):
                 content = st.text_area("오늘 하루는 어떠셨나요?", height=250, placeholder="이야기를 털어놓으세요.")
                 if st.form_submit_button("기록 저장하고 조언 듣기 ✨", type="primary", use_container_width=True):
-                    if check_rate_limit("new_diary", 5):
+                    if check_rate_limit("diary_save", current_user_id):
                         if content:
                             safe_content = sanitize_for_sheets(content)
+                            local_score = local_mood_score(safe_content) # ⭐ AI 분석 전 임시 점수
                             
                             # ⭐ [STEP 1] 먼저 구글 시트에 내 일기만 안전하게 '가저장' 합니다.
-                            all_diaries_latest = conn.read(worksheet="diaries", ttl=0)
-                            if all_diaries_latest.empty or 'id' not in all_diaries_latest.columns: new_id = 1
-                            else: new_id = int(pd.to_numeric(all_diaries_latest['id'], errors='coerce').max()) + 1
+                            try:
+                                all_diaries_latest = read_sheet_fresh("diaries") # 새 id는 원격 최신 데이터로만 결정
+                            except Exception:
+                                st.error("저장소에 연결할 수 없어 지금은 새 일기를 저장할 수 없어요. 잠시 후 다시 시도해주세요.")
+                                st.stop()
+                            new_id = next_diary_id(all_diaries_latest)
                             
-                            temp_data = pd.DataFrame([{
+                            temp_data = {
                                 "id": new_id, 
                                 "user_id": current_user_id,
                                 "username": current_username,
                                 "date": selected_date_str,
                                 "content": safe_content, 
                                 "ai_advice": "AI가 마음을 분석하고 있어요... ⏳ (새로고침 해주세요)", # 임시 문구
-                                "emotion_tag": 3,
+                                "emotion_tag": local_score,
                                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                                "chat_history": "[]"
-                            }])
-                            updated = pd.concat([all_diaries_latest, temp_data], ignore_index=True) if not all_diaries_latest.empty else temp_data
-                            conn.update(worksheet="diaries", data=updated)
+                                "chat_history": "[]",
+                                "summary": "",
+                                "tags": ""
+                            }
+                            update_sheet("diaries", [{"op": "append", "row": temp_data}], base=all_diaries_latest)
                             
                             # ⭐ [STEP 2] 가저장 완료 후, 맘 편하게 AI 분석 시작 (재시도 로직 작동)
                             with st.spinner("AI가 일기를 읽고 있어요. 💡답변이 완료될 때까지 화면을 끄거나 나가지 말아주세요!"):
                                 past_history = get_past_diaries_text(current_user_id)
                                 full_res = get_ai_response(safe_content, current_name, past_history)
                                 
-                                if "|||" in full_res: advice, sc = full_res.split("|||"); score=int(sc.strip())
-                                else: advice=full_res; score=3
+                                analysis = parse_ai_response(full_res)
+                                ai_score = analysis["score"]
+                                if ai_score is not None: record_score_agreement(local_score, ai_score)
+                                score = ai_score if ai_score is not None else local_score
                                 
                                 # ⭐ [STEP 3] AI 답변이 무사히 오면, 방금 저장한 행을 찾아서 업데이트(Update)
-                                final_diaries = conn.read(worksheet="diaries", ttl=0)
-                                final_diaries['id'] = pd.to_numeric(final_diaries['id'], errors='coerce')
-                                idx = final_diaries.index[final_diaries['id'] == new_id].tolist()[0]
-                                
-                                final_diaries.at[idx, 'ai_advice'] = advice.strip()
-                                final_diaries.at[idx, 'emotion_tag'] = max(1, min(5, score))
-                                
-                                conn.update(worksheet="diaries", data=final_diaries)
+                                update_sheet("diaries", [{"op": "set", "column": "id", "value": new_id, "values": {
+                                    "ai_advice": analysis["advice"],
+                                    "emotion_tag": score,
+                                    "summary": sanitize_for_sheets(analysis["summary"]),
+                                    "tags": sanitize_for_sheets(format_tags(analysis["tags"]))
+                                }}])
                                 st.cache_data.clear()
+                                st.session_state.pop('export_csv', None)
                                 st.rerun()
 
     # === [메뉴 3] 내 정보 수정 ===
@@ -756,7 +1329,7 @@ else:
                 btn_name = st.form_submit_button("닉네임 변경", type="primary")
                 
                 if btn_name:
-                    if check_rate_limit("change_info", 3):
+                    if check_rate_limit("profile", current_user_id):
                         safe_name = sanitize_for_sheets(new_nickname)
                         success, msg = update_user_info(current_user_id, new_name=safe_name)
                         if success:
@@ -776,7 +1349,7 @@ else:
                 btn_pw = st.form_submit_button("비밀번호 변경", type="primary")
                 
                 if btn_pw:
-                    if check_rate_limit("change_pw", 3):
+                    if check_rate_limit("profile", current_user_id):
                         user_data = login_check(current_username, cur_pw)
                         
                         if user_data is None:
@@ -0,0 +1,172 @@
+"""
+일기별 상담 대화 프롬프트 캐시
+
+지시문 + 일기 본문 + 지금까지의 대화를 Gemini 캐시로 만들어 두고, 매 턴에는 캐시 이후의 대화와 새 질문만 보냅니다.
+streamlit에 의존하지 않으므로 가짜 클라이언트로 바로 테스트할 수 있습니다.
+"""
+import hashlib
+import logging
+import threading
+import time
+
+CHAT_MODEL = 'gemini-2.5-flash'
+CHAT_CACHE_TTL_SEC = 3600
+CHAT_CACHE_MIN_TOKENS = 1024      # 모델의 명시적 캐시 최소 크기 (이보다 작으면 만들지 않음)
+CHAT_CACHE_REFRESH_TURNS = 6      # 캐시 이후 대화가 이만큼 쌓이면 대화까지 포함해 캐시를 다시 만듦
+
+logger = logging.getLogger("emotion_diary")
+
+# 프로세스 전체에서 공유 (streamlit은 스크립트를 매번 다시 실행하지만 import된 모듈은 유지됨)
+CHAT_CACHE_REGISTRY = {"lock": threading.Lock(), "entries": {}}
+
+
+def build_chat_instructions(user_name):
+    return f"""
+        당신은 전문 심리 상담가입니다.
+        <instructions>
+        내담자의 이름은 '{user_name}'입니다. 대화할 때 '내담자'나 '회원님'이라는 호칭 대신, 반드시 '{user_name}님'이라고 다정하게 불러주세요.
+        사용자의 일기(<diary>)와 이전 대화(<history>)를 바탕으로, 새로운 질문(<question>)에 답변하세요.
+        따뜻하게 공감하는 태도를 유지하세요.
+        </instructions>
+        """
+
+
+def build_diary_block(diary_content):
+    return f"""
+        <diary>
+        {diary_content}
+        </diary>
+        """
+
+
+def build_history_block(chat_history):
+    history_text = ""
+    for chat in chat_history:
+        role = "상담사" if chat["role"] == "model" else "내담자"
+        history_text += f"{role}: {chat['text']}\n"
+    return f"""
+        <history>
+        {history_text}
+        </history>
+        """
+
+
+def build_question_block(new_question):
+    return f"""
+        <question>
+        {new_question}
+        </question>
+        """
+
+
+def estimate_tokens(text):
+    # 한국어는 대략 1.5~2글자에 1토큰. 최소 크기 판단용이므로 적게 잡는 쪽으로 추정
+    return len(text) // 2
+
+
+def content_hash(*parts):
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def history_hash(chat_history):
+    return content_hash(*[f"{c['role']}:{c['text']}" for c in chat_history])
+
+
+def get_chat_cache(diary_id, diary_content, user_name, chat_history, chat_client, registry=CHAT_CACHE_REGISTRY):
+    """
+    (캐시 이름, 캐시에 포함된 대화 수)를 반환. 캐시를 쓸 수 없으면 (None, 0)
+    """
+    diary_hash = content_hash(user_name, diary_content)
+    now = time.time()
+    with registry["lock"]:
+        entry = registry["entries"].get(diary_id)
+
+    if entry and entry["hash"] == diary_hash and entry["expires"] > now:
+        cached_len = entry["history_len"]
+        prefix_ok = cached_len <= len(chat_history) and history_hash(chat_history[:cached_len]) == entry["history_hash"]
+        if prefix_ok and len(chat_history) - cached_len < CHAT_CACHE_REFRESH_TURNS:
+            return (entry["name"], cached_len) if entry["name"] else (None, 0)
+
+    if entry:
+        evict_chat_cache(diary_id, chat_client, registry) # 내용이 바뀌었거나, 만료됐거나, 대화가 많이 쌓임
+
+    instructions = build_chat_instructions(user_name)
+    contents = [build_diary_block(diary_content)]
+    if chat_history:
+        contents.append(build_history_block(chat_history))
+
+    name = None
+    if estimate_tokens(instructions + "".join(contents)) >= CHAT_CACHE_MIN_TOKENS:
+        try:
+            cache = chat_client.caches.create(
+                model=CHAT_MODEL,
+                config={
+                    "system_instruction": instructions,
+                    "contents": contents,
+                    "ttl": f"{CHAT_CACHE_TTL_SEC}s"
+                }
+            )
+            name = cache.name
+        except Exception as e:
+            logger.info("chat cache unavailable for diary %s: %s", diary_id, e)
+
+    # 실패하거나 너무 작은 경우도 기록해 두고, 대화가 더 쌓이면 다시 판단
+    with registry["lock"]:
+        registry["entries"][diary_id] = {
+            "hash": diary_hash,
+            "name": name,
+            "history_len": len(chat_history),
+            "history_hash": history_hash(chat_history),
+            "expires": now + CHAT_CACHE_TTL_SEC - 60
+        }
+    return (name, len(chat_history)) if name else (None, 0)
+
+
+def evict_chat_cache(diary_id, chat_client, registry=CHAT_CACHE_REGISTRY):
+    with registry["lock"]:
+        entry = registry["entries"].pop(diary_id, None)
+    if entry and entry["name"] and chat_client is not None:
+        try:
+            chat_client.caches.delete(name=entry["name"])
+        except Exception:
+            pass # 이미 만료된 캐시는 서버에서 자동 삭제됨
+
+
+def generate_chat_reply(chat_client, diary_content, chat_history, new_question, user_name, diary_id=None, registry=CHAT_CACHE_REGISTRY):
+    """
+    캐시가 있으면 캐시 이후의 대화와 질문만, 없으면 전체 프롬프트를 보내 답변 텍스트를 반환 (API 오류는 호출 측에서 처리)
+    """
+    cache_name, cached_len = None, 0
+    if diary_id is not None:
+        cache_name, cached_len = get_chat_cache(diary_id, diary_content, user_name, chat_history, chat_client, registry)
+
+    started = time.time()
+    response = None
+    if cache_name:
+        try:
+            response = chat_client.models.generate_content(
+                model=CHAT_MODEL,
+                contents=build_history_block(chat_history[cached_len:]) + build_question_block(new_question),
+                config={"cached_content": cache_name}
+            )
+        except Exception as e:
+            if "429" in str(e) or "Quota" in str(e):
+                raise
+            # 서버에서 캐시가 사라진 경우: 캐시를 비우고 전체 프롬프트로 재시도
+            evict_chat_cache(diary_id, chat_client, registry)
+            cache_name = None
+    if response is None:
+        response = chat_client.models.generate_content(
+            model=CHAT_MODEL,
+            contents=build_chat_instructions(user_name) + build_diary_block(diary_content)
+                     + build_history_block(chat_history) + build_question_block(new_question)
+        )
+
+    usage = getattr(response, "usage_metadata", None)
+    logger.info(
+        "chat turn: diary=%s cached=%s prompt_tokens=%s cached_tokens=%s latency=%.2fs",
+        diary_id, bool(cache_name),
+        getattr(usage, "prompt_token_count", None), getattr(usage, "cached_content_token_count", None),
+        time.time() - started
+    )
+    return response.text
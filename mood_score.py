@@ -0,0 +1,86 @@
+"""
+로컬 감정 점수
+
+감정 사전 + 부정어/강조어 처리로 일기의 1~5점 임시 점수를 즉시 계산합니다 (AI 분석이 끝나기 전 차트 표시용).
+streamlit에 의존하지 않으므로 바로 테스트할 수 있습니다.
+"""
+import re
+
+# ⭐ 로컬 감정 사전 (어간 및 자주 쓰는 활용형 기준, 값은 강도)
+POSITIVE_WORDS = {
+    "행복": 2, "기쁘": 2, "기쁜": 2, "기뻐": 2, "기뻤": 2, "즐거": 2, "즐겁": 2, "신나": 2, "신난": 2, "신났": 2,
+    "뿌듯": 2, "최고": 2,
+    "설레": 1, "설렌": 1, "설렜": 1, "좋": 1, "감사": 1, "고마": 1, "고맙": 1, "편안": 1, "편해": 1, "편했": 1, "웃": 1,
+    "사랑": 1, "만족": 1, "다행": 1, "재밌": 1, "재미있": 1, "상쾌": 1, "힐링": 1, "평온": 1, "기대": 1,
+}
+NEGATIVE_WORDS = {
+    "슬프": 2, "슬픈": 2, "슬퍼": 2, "슬펐": 2, "우울": 2, "힘들": 2, "힘든": 2, "힘드": 2, "짜증": 2,
+    "화나": 2, "화난": 2, "화났": 2, "화가": 2,
+    "불안": 2, "외롭": 2, "외로": 2, "속상": 2, "괴롭": 2, "괴로": 2, "스트레스": 2, "최악": 2, "절망": 2,
+    "걱정": 1, "피곤": 1, "지치": 1, "지친": 1, "지쳐": 1, "지쳤": 1, "싫": 1, "울었": 1, "눈물": 1, "실망": 1,
+    "답답": 1, "후회": 1, "아프": 1, "아픈": 1, "아파": 1, "아팠": 1,
+    "무섭": 1, "무서운": 1, "무서워": 1, "무서웠": 1, "두렵": 1, "두려운": 1, "두려워": 1, "두려웠": 1,
+    "억울": 1, "재미없": 1, "서운": 1, "귀찮": 1,
+}
+# 바로 뒤에 특정 말이 올 때만 감정으로 인정하는 어간 (예: "화가 났다"는 분노, "화가가 되고 싶다"는 아님)
+PHRASE_STEMS = {"화가": ("나", "났")}
+INTENSIFIERS = ("너무", "정말", "진짜", "매우", "엄청", "완전", "아주", "무척")
+NEGATION_PREFIXES = ("안", "못")           # 예: "안 좋았다", "못 잤다"
+NEGATION_SUFFIXES = ("지않", "지못", "지마")  # 예: "좋지 않았다", "행복하지 못했다"
+STEM_EXCLUSIONS = ("아프리카", "아파트", "기대어", "기대서", "기대고")  # 어간으로 시작하지만 감정과 무관한 단어
+
+STEMS = sorted(list(POSITIVE_WORDS) + list(NEGATIVE_WORDS), key=len, reverse=True)
+
+
+def match_stem(token):
+    """
+    어절에서 감정 어간을 찾아 (어간, 앞에 붙은 부정어/강조어)를 반환. 없으면 (None, "")
+    어간은 어절 맨 앞에서만 인정 ("전화나"의 "화나"는 제외). 붙여 쓴 부정어/강조어 뒤는 허용 ("안좋았다", "너무좋아")
+    """
+    if token.startswith(STEM_EXCLUSIONS):
+        return None, ""
+    prefixes = [""] + [p for p in NEGATION_PREFIXES + INTENSIFIERS if token.startswith(p)]
+    # 긴 어간부터 검사 ("재미없"이 "재미있"/"좋" 보다 먼저 잡히도록)
+    for word in STEMS:
+        prefix = next((p for p in prefixes if token[len(p):].startswith(word)), None)
+        if prefix is not None:
+            return word, prefix
+    return None, ""
+
+
+def local_mood_score(text):
+    """
+    감정 사전 + 부정어 처리로 1~5점 임시 점수를 즉시 계산
+    """
+    tokens = re.findall(r"[가-힣A-Za-z]+", str(text))
+    pos_total, neg_total = 0.0, 0.0
+
+    for i, token in enumerate(tokens):
+        word, prefix = match_stem(token)
+        if word is None:
+            continue
+
+        prev_token = tokens[i - 1] if i > 0 else ""
+        next_token = tokens[i + 1] if i + 1 < len(tokens) else ""
+        if word in PHRASE_STEMS:
+            rest = token[len(prefix) + len(word):] or next_token
+            if not rest.startswith(PHRASE_STEMS[word]):
+                continue
+
+        polarity = 1 if word in POSITIVE_WORDS else -1
+        weight = POSITIVE_WORDS.get(word, NEGATIVE_WORDS.get(word))
+        joined = token + next_token
+        if prefix in NEGATION_PREFIXES or prev_token in NEGATION_PREFIXES or any(neg in joined for neg in NEGATION_SUFFIXES):
+            polarity = -polarity
+        if prefix in INTENSIFIERS or prev_token in INTENSIFIERS:
+            weight *= 1.5
+
+        if polarity > 0: pos_total += weight
+        else: neg_total += weight
+
+    hits = pos_total + neg_total
+    if hits == 0:
+        return 3
+    ratio = (pos_total - neg_total) / hits
+    confidence = min(1.0, hits / 4) # 감정 표현이 적으면 3점 쪽으로 완만하게
+    return max(1, min(5, int(round(3 + 2 * ratio * confidence))))
@@ -0,0 +1,63 @@
+"""
+시트 행 단위 작업
+
+추가/수정/삭제 작업을 시트에서 읽은 DataFrame에 다시 적용합니다 (대기열에 보관된 쓰기를 최신 시트에 반영할 때 사용).
+streamlit에 의존하지 않으므로 바로 테스트할 수 있습니다.
+"""
+import logging
+
+import pandas as pd
+
+logger = logging.getLogger("emotion_diary")
+
+
+def ensure_text_columns(df, columns):
+    # 빈 값만 있는 컬럼은 시트에서 float64로 읽히므로, 문자열을 넣기 전에 object로 변환
+    for col in columns:
+        df[col] = df.get(col, pd.Series(index=df.index, dtype=object)).astype(object)
+    return df
+
+
+def row_match(df, column, value):
+    # value가 목록이면 그중 하나와 일치하는 행, 숫자면 숫자로 비교 (시트의 id는 float로 읽힐 수 있음)
+    if column not in df.columns:
+        return pd.Series(False, index=df.index)
+    values = value if isinstance(value, list) else [value]
+    if all(pd.api.types.is_number(v) for v in values):
+        return pd.to_numeric(df[column], errors='coerce').isin(values)
+    return df[column].astype(str).isin([str(v) for v in values])
+
+
+def apply_sheet_op(df, op):
+    if op["op"] == "append":
+        new_row = pd.DataFrame([op["row"]])
+        return pd.concat([df, new_row], ignore_index=True) if not df.empty else new_row
+    if op["op"] == "set":
+        df = df.copy()
+        mask = row_match(df, op["column"], op["value"])
+        # 시트에서 읽은 컬럼의 dtype(float64, str 등)과 상관없이 값을 넣을 수 있도록 object로 변환
+        ensure_text_columns(df, list(op["values"]))
+        for col, val in op["values"].items():
+            df.loc[mask, col] = val
+        return df
+    if op["op"] == "delete":
+        return df[~row_match(df, op["column"], op["value"])]
+    raise ValueError(f"알 수 없는 작업: {op['op']}")
+
+
+def apply_sheet_ops(df, ops):
+    """
+    행 단위 작업 목록을 DataFrame에 적용하고 (결과, 적용하지 못한 작업 목록)을 반환
+    - {"op": "append", "row": {...}}
+    - {"op": "set", "column": "id", "value": 5, "values": {...}}
+    - {"op": "delete", "column": "id", "value": [1, 2, 3]}
+    적용에 실패한 작업은 건너뛰므로, 잘못된 작업 하나가 이후의 모든 쓰기를 막지 않음
+    """
+    rejected = []
+    for op in ops:
+        try:
+            df = apply_sheet_op(df, op)
+        except Exception as e:
+            logger.warning("rejected sheet op %s: %s", op.get("op"), e)
+            rejected.append(op)
+    return df, rejected
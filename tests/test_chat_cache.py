@@ -0,0 +1,121 @@
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chat_cache
+
+
+class FakeClient:
+    """caches.create/delete 와 models.generate_content 만 흉내 내는 로컬 가짜 클라이언트"""
+
+    def __init__(self, fail_create=False, fail_cached_call=False):
+        self.fail_create = fail_create
+        self.fail_cached_call = fail_cached_call
+        self.created = []
+        self.deleted = []
+        self.calls = []
+        self.caches = SimpleNamespace(create=self._create, delete=self._delete)
+        self.models = SimpleNamespace(generate_content=self._generate_content)
+
+    def _create(self, model, config):
+        if self.fail_create:
+            raise RuntimeError("400 cached content is too small")
+        self.created.append(config)
+        return SimpleNamespace(name=f"cachedContents/{len(self.created)}")
+
+    def _delete(self, name):
+        self.deleted.append(name)
+
+    def _generate_content(self, model, contents, config=None):
+        cached = (config or {}).get("cached_content")
+        if cached and self.fail_cached_call:
+            raise RuntimeError("404 cached content not found")
+        self.calls.append({"contents": contents, "cached_content": cached})
+        return SimpleNamespace(text="답변", usage_metadata=None)
+
+
+@pytest.fixture
+def registry():
+    return {"lock": threading.Lock(), "entries": {}}
+
+
+LONG_DIARY = "오늘은 회사에서 정말 힘든 하루를 보냈다. " * 150
+SHORT_DIARY = "좋은 하루"
+
+
+def reply(client, registry, diary, history, diary_id=1):
+    return chat_cache.generate_chat_reply(client, diary, history, "어떻게 하면 좋을까요?", "민수", diary_id=diary_id, registry=registry)
+
+
+def turns(n):
+    return [{"role": "user" if i % 2 == 0 else "model", "text": f"메시지 {i}"} for i in range(n)]
+
+
+def test_short_diary_skips_cache_create(registry):
+    client = FakeClient()
+    reply(client, registry, SHORT_DIARY, [])
+    reply(client, registry, SHORT_DIARY, turns(2))
+    assert client.created == []
+    assert all(call["cached_content"] is None for call in client.calls)
+
+
+def test_long_diary_reuses_cache_and_sends_only_new_turns(registry):
+    client = FakeClient()
+    reply(client, registry, LONG_DIARY, [])
+    reply(client, registry, LONG_DIARY, turns(2))
+    reply(client, registry, LONG_DIARY, turns(4))
+
+    assert len(client.created) == 1
+    assert [call["cached_content"] for call in client.calls] == ["cachedContents/1"] * 3
+    assert all(LONG_DIARY not in call["contents"] for call in client.calls)
+    assert "메시지 3" in client.calls[-1]["contents"]
+
+
+def test_cache_is_rebuilt_with_history_every_n_turns(registry):
+    client = FakeClient()
+    reply(client, registry, LONG_DIARY, [])
+    history = turns(chat_cache.CHAT_CACHE_REFRESH_TURNS)
+    reply(client, registry, LONG_DIARY, history)
+
+    assert len(client.created) == 2
+    assert client.deleted == ["cachedContents/1"]
+    assert "메시지 0" in client.created[1]["contents"][-1]
+    # 캐시에 들어간 대화는 다시 보내지 않음
+    assert "메시지 0" not in client.calls[-1]["contents"]
+
+
+def test_edited_diary_gets_new_cache(registry):
+    client = FakeClient()
+    reply(client, registry, LONG_DIARY, [])
+    reply(client, registry, LONG_DIARY + " 수정", [])
+    assert len(client.created) == 2
+    assert client.deleted == ["cachedContents/1"]
+
+
+def test_evict_deletes_remote_cache(registry):
+    client = FakeClient()
+    reply(client, registry, LONG_DIARY, [])
+    chat_cache.evict_chat_cache(1, client, registry)
+    assert client.deleted == ["cachedContents/1"]
+    assert registry["entries"] == {}
+
+
+def test_failed_create_falls_back_without_retrying_every_turn(registry):
+    client = FakeClient(fail_create=True)
+    reply(client, registry, LONG_DIARY, [])
+    reply(client, registry, LONG_DIARY, turns(2))
+    assert all(call["cached_content"] is None for call in client.calls)
+    assert LONG_DIARY in client.calls[-1]["contents"]
+    assert registry["entries"][1]["name"] is None
+
+
+def test_missing_remote_cache_falls_back_to_full_prompt(registry):
+    client = FakeClient(fail_cached_call=True)
+    assert reply(client, registry, LONG_DIARY, []) == "답변"
+    assert LONG_DIARY in client.calls[-1]["contents"]
+    assert 1 not in registry["entries"]
@@ -0,0 +1,62 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mood_score import local_mood_score
+
+
+@pytest.mark.parametrize("text", [
+    "기쁜 하루",
+    "기뻐요",
+    "오늘은 정말 행복하고 즐거운 하루였다",
+    "신난 주말",
+])
+def test_positive_conjugations(text):
+    assert local_mood_score(text) >= 4
+
+
+@pytest.mark.parametrize("text", [
+    "슬픈 하루였다",
+    "너무 슬퍼서 울었다",
+    "머리가 아파서 쉬었다",
+    "밤길이 무서워",
+    "두려운 마음",
+    "친구 때문에 화가 났다",
+    "화가나서 잠이 안 왔다",
+])
+def test_negative_conjugations(text):
+    assert local_mood_score(text) <= 2
+
+
+@pytest.mark.parametrize("text", [
+    "기분이 안 좋았다",
+    "기분이 안좋았다",
+    "하나도 행복하지 않았다",
+    "좋지 못한 소식",
+])
+def test_negation_flips_positive_words(text):
+    assert local_mood_score(text) <= 2
+
+
+def test_negated_negative_word_is_not_negative():
+    assert local_mood_score("전혀 힘들지 않았다") >= 4
+
+
+def test_intensifier_strengthens_score():
+    assert local_mood_score("좋았다 좋았다 너무 피곤했다") < local_mood_score("좋았다 좋았다 피곤했다")
+    assert local_mood_score("진짜좋아") == 4
+
+
+@pytest.mark.parametrize("text", [
+    "전화나 했다",
+    "대화나 좀 하자",
+    "화가가 되고 싶다",
+    "아프리카 다큐를 봤다",
+    "아파트 단지를 걸었다",
+    "그냥 평범한 하루",
+])
+def test_neutral_or_unrelated_words_score_three(text):
+    assert local_mood_score(text) == 3
@@ -0,0 +1,90 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sheet_ops import apply_sheet_ops, row_match
+
+
+def diaries():
+    """시트에서 읽은 것처럼: id는 float, 문자열 컬럼은 pandas 3의 str dtype"""
+    return pd.DataFrame({
+        "id": [1.0, 2.0, 3.0],
+        "user_id": pd.Series(["u1", "u2", "u1"], dtype="str"),
+        "content": pd.Series(["첫 일기", "둘째 일기", "셋째 일기"], dtype="str"),
+        "mood": [3.0, 4.0, np.nan],
+    })
+
+
+def test_append_replays_onto_fresh_sheet():
+    ops = [{"op": "append", "row": {"id": 4, "user_id": "u2", "content": "새 일기", "mood": 5}}]
+    df, rejected = apply_sheet_ops(diaries(), ops)
+    assert rejected == []
+    assert list(df["id"]) == [1, 2, 3, 4]
+    assert df.iloc[-1]["content"] == "새 일기"
+
+
+def test_append_to_empty_sheet():
+    df, rejected = apply_sheet_ops(pd.DataFrame(), [{"op": "append", "row": {"id": 1, "content": "첫 일기"}}])
+    assert rejected == []
+    assert df.to_dict("records") == [{"id": 1, "content": "첫 일기"}]
+
+
+def test_set_puts_numbers_and_text_into_string_columns():
+    ops = [{"op": "set", "column": "id", "value": 2, "values": {"content": 123, "mood": "좋음", "summary": "요약"}}]
+    df, rejected = apply_sheet_ops(diaries(), ops)
+    assert rejected == []
+    row = df[df["id"] == 2].iloc[0]
+    assert row["content"] == 123
+    assert row["mood"] == "좋음"
+    assert row["summary"] == "요약"
+    assert df[df["id"] == 1].iloc[0]["content"] == "첫 일기"
+
+
+def test_delete_with_list_of_ids():
+    df, rejected = apply_sheet_ops(diaries(), [{"op": "delete", "column": "id", "value": [1, 3]}])
+    assert rejected == []
+    assert list(df["id"]) == [2.0]
+
+
+def test_ops_replay_in_order():
+    ops = [
+        {"op": "append", "row": {"id": 4, "user_id": "u1", "content": "새 일기"}},
+        {"op": "set", "column": "id", "value": 4, "values": {"content": "고친 일기"}},
+        {"op": "delete", "column": "user_id", "value": "u2"},
+    ]
+    df, rejected = apply_sheet_ops(diaries(), ops)
+    assert rejected == []
+    assert list(df["id"]) == [1, 3, 4]
+    assert df.iloc[-1]["content"] == "고친 일기"
+
+
+def test_float_ids_match_integer_values():
+    df = diaries()
+    assert list(row_match(df, "id", 2)) == [False, True, False]
+    assert list(row_match(df, "id", np.int64(3))) == [False, False, True]
+    assert list(row_match(df, "id", [1, 2.0])) == [True, True, False]
+
+
+def test_string_values_match_as_text():
+    df = diaries()
+    assert list(row_match(df, "user_id", "u1")) == [True, False, True]
+    # 문자열로 넘긴 숫자는 숫자로 바꾸지 않고 글자 그대로 비교
+    assert not row_match(df, "id", "2").any()
+    assert list(row_match(df, "id", "2.0")) == [False, True, False]
+
+
+def test_missing_column_matches_nothing():
+    assert not row_match(diaries(), "chat_history", "x").any()
+
+
+def test_bad_op_is_rejected_without_blocking_later_ops():
+    bad = {"op": "rename", "column": "id", "value": 1}
+    missing_key = {"op": "set", "column": "id", "value": 1}
+    good = {"op": "delete", "column": "id", "value": 1}
+    df, rejected = apply_sheet_ops(diaries(), [bad, missing_key, good])
+    assert rejected == [bad, missing_key]
+    assert list(df["id"]) == [2.0, 3.0]